@@ -1,6 +1,13 @@
+import hashlib
 import re
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from io import BytesIO
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 
@@ -61,10 +68,23 @@ if "sirens_from_file" not in st.session_state:
 if "df_result" not in st.session_state:
     st.session_state.df_result = None
 
+if "df_result_hash" not in st.session_state:
+    st.session_state.df_result_hash = None
+
 
 # =========================
 # Helpers (SIREN parsing + upload)
 # =========================
+_SIREN_RE = re.compile(r"\b\d{9}\b")
+_STRIP_RE = re.compile(r"[ \t]+")
+
+# openpyxl ne lit pas les .xls (BIFF) ; chaque format a son moteur dédié
+_EXCEL_ENGINES = {
+    ".xlsx": "openpyxl",
+    ".xlsm": "openpyxl",
+    ".xls": "xlrd",
+    ".xlsb": "pyxlsb",
+}
 def extract_sirens_from_text(text: str) -> list[str]:
     """
     Extrait toutes les occurrences de 9 chiffres (SIREN) d'un texte.
@@ -72,57 +92,96 @@ def extract_sirens_from_text(text: str) -> list[str]:
     """
     if not text:
         return []
-    compact = text.replace(" ", "").replace("\t", "")
-    found = re.findall(r"\b\d{9}\b", compact)
+    compact = _STRIP_RE.sub("", text)
+    found = _SIREN_RE.findall(compact)
+    return list(dict.fromkeys(found))
+
 
-    seen = set()
-    out = []
-    for s in found:
-        if s not in seen:
-            seen.add(s)
-            out.append(s)
-    return out
+def _sniff_sep(head: bytes) -> str:
+    """
+    Vote de délimiteur sur les premières lignes : le bon séparateur a un
+    nombre d'occurrences stable d'une ligne à l'autre (écart-type minimal).
+    Évite le sniffer `sep=None` qui force le parseur Python (5-10x plus lent).
+    """
+    lines = head.decode("utf-8", "ignore").splitlines()[:50]
+    scores = {
+        c: statistics.pstdev([ln.count(c) for ln in lines])
+        for c in (";", ",", "\t", "|")
+        if any(c in ln for ln in lines)
+    }
+    return min(scores, key=scores.get) if scores else ","
 
 
-def load_df_from_upload(uploaded_file) -> pd.DataFrame:
-    suffix = Path(uploaded_file.name).suffix.lower()
+@st.cache_data(show_spinner=False)
+def _parse_bytes(content_key: str, name: str, _data: bytes) -> pd.DataFrame:
+    suffix = Path(name).suffix.lower()
 
-    if suffix in [".xlsx", ".xls"]:
-        return pd.read_excel(uploaded_file, engine="openpyxl")
+    engine = _EXCEL_ENGINES.get(suffix)
+    if engine:
+        return pd.read_excel(BytesIO(_data), engine=engine, dtype_backend="pyarrow")
 
     if suffix == ".csv":
-        # lecture tolérante (auto-sep) + fallback ';' fréquent FR
-        try:
-            return pd.read_csv(uploaded_file, sep=None, engine="python")
-        except Exception:
-            return pd.read_csv(uploaded_file, sep=";")
+        sep = _sniff_sep(_data[:65536])
+        return pd.read_csv(BytesIO(_data), sep=sep, engine="pyarrow", dtype_backend="pyarrow")
 
-    raise ValueError("Format non supporté. Merci d'importer un .csv ou .xlsx/.xls")
+    raise ValueError("Format non supporté. Merci d'importer un .csv ou .xlsx/.xlsm/.xls/.xlsb")
 
 
+def load_df_from_upload(uploaded_file) -> pd.DataFrame:
+    # octets lus une seule fois ; la clé de cache est leur empreinte de contenu
+    # (`_data` souligné pour que Streamlit ne re-hashe pas tout le buffer)
+    raw = uploaded_file.getvalue()
+    key = hashlib.blake2b(raw, digest_size=16).hexdigest()
+    return _parse_bytes(key, uploaded_file.name, raw)
+
+
+def _findall_strings(s: pd.Series) -> list[str]:
+    """Regex SIREN dispatchée cellule par cellule côté C (pas de concat géante)."""
+    # déjà des chaînes (Arrow ou pandas) => pas de conversion inutile
+    if s.dtype == object or not pd.api.types.is_string_dtype(s.dtype):
+        s = s.astype("string")
+
+    hits = (
+        s.str.replace(r"[ \t]", "", regex=True)
+        .str.findall(_SIREN_RE.pattern)
+        .dropna()
+    )
+    if hits.empty:
+        return []
+    return np.concatenate(hits.values).tolist()
+
+
+@st.cache_data(show_spinner=False)
 def extract_sirens_from_df(df: pd.DataFrame, column: str | None = None) -> list[str]:
     if df is None or df.empty:
         return []
 
     if column and column in df.columns:
-        text = "\n".join(df[column].astype(str).tolist())
-        return extract_sirens_from_text(text)
+        return list(dict.fromkeys(_findall_strings(df[column])))
+
+    found: list[str] = []
+
+    # colonnes numériques : un SIREN y est un entier à 9 chiffres, pas besoin
+    # de stringifier ni de regexer ces cellules
+    for c in df.select_dtypes(include="number").columns:
+        col = df[c].dropna()
+        if col.empty:
+            continue
+        # passage par numpy : les extension arrays Arrow n'implémentent pas `%`
+        v = col.to_numpy(dtype="float64")
+        mask = (v >= 100_000_000) & (v < 1_000_000_000) & (v == np.floor(v))
+        found.extend(v[mask].astype("int64").astype(str).tolist())
 
-    # scan toutes colonnes
-    all_text = []
-    for col in df.columns:
-        all_text.extend(df[col].astype(str).tolist())
-    return extract_sirens_from_text("\n".join(all_text))
+    # colonnes texte uniquement
+    text = df.select_dtypes(include=["object", "string"])
+    if not text.empty:
+        found.extend(_findall_strings(text.stack()))
+
+    return list(dict.fromkeys(found))
 
 
 def merge_unique(a: list[str], b: list[str]) -> list[str]:
-    seen = set()
-    out = []
-    for s in (a + b):
-        if s not in seen:
-            seen.add(s)
-            out.append(s)
-    return out
+    return list(dict.fromkeys(a + b))
 
 
 # =========================
@@ -131,6 +190,31 @@ def merge_unique(a: list[str], b: list[str]) -> list[str]:
 INSEE_API_KEY = st.secrets.get("INSEE_API_KEY", "")
 
 
+@st.cache_data(ttl=3600, show_spinner=False)
+def _cached_get_sirets(siren: str, only_active: bool, page_size: int, _should_stop=None) -> list[dict]:
+    # clé API lue ici (pas en paramètre) pour que le secret ne serve pas de clé de cache ;
+    # `_should_stop` souligné : exclu de la clé, mais un crawl stoppé lève donc
+    # aucun résultat partiel n'est mis en cache
+    rows, _ = get_sirets_from_siren(
+        siren=siren,
+        api_key=st.secrets.get("INSEE_API_KEY", ""),
+        only_active=only_active,
+        page_size=page_size,
+        should_stop=_should_stop,
+    )
+    return rows
+
+
+def _df_fingerprint(df: pd.DataFrame) -> str:
+    return hashlib.md5(pd.util.hash_pandas_object(df, index=False).values.tobytes()).hexdigest()
+
+
+@st.cache_data(show_spinner=False)
+def _cached_export(df_hash: str, _df: pd.DataFrame) -> bytes:
+    # la clé de cache est l'empreinte ; `_df` (underscore) n'est pas re-haché
+    return export_sirets_xlsx(_df)
+
+
 # =========================
 # Layout
 # =========================
@@ -141,7 +225,7 @@ with left:
     with st.container(border=True):
         st.subheader("📥 Import & saisie")
     
-        uploaded = st.file_uploader("Importer un fichier CSV / Excel", type=["csv", "xlsx", "xls"])
+        uploaded = st.file_uploader("Importer un fichier CSV / Excel", type=["csv", "xlsx", "xlsm", "xls", "xlsb"])
 
         df_upload = None
         selected_col = None
@@ -227,27 +311,51 @@ if btn_run:
     overall = st.progress(0)
     status_text.write("Prêt")
 
-    all_rows = []
+    frames: list[pd.DataFrame] = []
     total = len(sirens_list)
 
-    try:
-        for i, s in enumerate(sirens_list, start=1):
-            if st.session_state.stop:
-                raise RuntimeError("STOP_REQUESTED")
-
-            status_text.info(f"SIREN {i}/{total} : {s}")
-            rows, _ = get_sirets_from_siren(
-                siren=s,
-                api_key=INSEE_API_KEY,
-                only_active=only_active,
-                page_size=int(page_size),
-                should_stop=lambda: st.session_state.stop,
-            )
+    # au plus ~100 rafraîchissements du front (chaque update = 1 message websocket)
+    tick = max(1, total // 100)
+    last_update = time.monotonic()
 
-            all_rows.extend(rows)
-            overall.progress(i / total)
-
-        df = pd.DataFrame(all_rows)
+    try:
+        # signal d'arrêt partagé : les threads du pool n'ont pas de
+        # ScriptRunContext, donc pas d'accès à st.session_state — seul le
+        # thread de script lit le bouton Stop et arme l'Event
+        stop_event = threading.Event()
+
+        # I/O-bound (HTTPS vers l'INSEE) => pool de threads borné
+        # (8 max pour rester sous les limites de débit INSEE)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = {
+                executor.submit(
+                    _cached_get_sirets,
+                    s,
+                    only_active,
+                    int(page_size),
+                    _should_stop=stop_event.is_set,
+                ): s
+                for s in sirens_list
+            }
+
+            for i, fut in enumerate(as_completed(futures), start=1):
+                if st.session_state.stop:
+                    # arme l'Event pour que les crawls en cours s'interrompent
+                    # à leur prochaine page, puis annule ceux non démarrés
+                    stop_event.set()
+                    executor.shutdown(cancel_futures=True)
+                    raise RuntimeError("STOP_REQUESTED")
+
+                rows = fut.result()
+                if rows:
+                    frames.append(pd.DataFrame(rows))
+
+                if i % tick == 0 or (time.monotonic() - last_update) > 0.1 or i == total:
+                    status_text.info(f"SIREN {i}/{total} : {futures[fut]}")
+                    overall.progress(i / total)
+                    last_update = time.monotonic()
+
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
 
         # Dédoublonnage global par SIRET
         if "SIRET" in df.columns:
@@ -258,6 +366,7 @@ if btn_run:
             df = df.sort_values(["SIREN", "SIRET"])
 
         st.session_state.df_result = df
+        st.session_state.df_result_hash = _df_fingerprint(df)
         status_text.success("Terminé ✅")
         overall.progress(1.0)
 
@@ -283,10 +392,14 @@ if df is not None:
 
     col1, col2, col3, col4 = st.columns(4)
 
-    nb_siren = df["SIREN"].nunique() if "SIREN" in df.columns else "—"
-    nb_siret = df["SIRET"].nunique() if "SIRET" in df.columns else len(df)
-    nb_actifs = int((df["État administratif"] == "Actif").sum()) if "État administratif" in df.columns else "—"
-    nb_sieges = int(df["Siège"].sum()) if "Siège" in df.columns else "—"
+    spec = {c: "nunique" for c in ("SIREN", "SIRET") if c in df.columns}
+    metrics = df.agg(spec) if spec else pd.Series(dtype=int)
+
+    nb_siren = int(metrics["SIREN"]) if "SIREN" in metrics else "—"
+    nb_siret = int(metrics["SIRET"]) if "SIRET" in metrics else len(df)
+    # count_nonzero sur le ndarray : pas de Series booléenne intermédiaire
+    nb_actifs = int(np.count_nonzero(df["État administratif"].to_numpy() == "Actif")) if "État administratif" in df.columns else "—"
+    nb_sieges = int(df["Siège"].to_numpy(dtype=bool).sum()) if "Siège" in df.columns else "—"
 
     col1.metric("SIREN", nb_siren)
     col2.metric("SIRET", nb_siret)
@@ -299,7 +412,8 @@ if df is not None:
 
     with tabs[1]:
         filename = "sirets.xlsx" if (isinstance(nb_siren, int) and nb_siren == 1) else "sirets_batch.xlsx"
-        xlsx_bytes = export_sirets_xlsx(df)
+        df_hash = st.session_state.df_result_hash or _df_fingerprint(df)
+        xlsx_bytes = _cached_export(df_hash, df)
         st.download_button(
             "Télécharger XLSX (avec résumé)",
             data=xlsx_bytes,
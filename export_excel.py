@@ -4,8 +4,6 @@ from io import BytesIO
 from typing import Tuple
 
 import pandas as pd
-from openpyxl.utils import get_column_letter
-from openpyxl.worksheet.table import Table, TableStyleInfo
 
 
 def _make_unique_columns(cols) -> list[str]:
@@ -21,14 +19,32 @@ def _make_unique_columns(cols) -> list[str]:
     return out
 
 
-def _autosize_columns(ws, max_width: int = 60, sample_rows: int = 200) -> None:
-    for col in ws.columns:
-        max_len = 0
-        col_letter = col[0].column_letter
-        for cell in col[:sample_rows]:
-            if cell.value is not None:
-                max_len = max(max_len, len(str(cell.value)))
-        ws.column_dimensions[col_letter].width = min(max_len + 2, max_width)
+def _column_widths(df: pd.DataFrame, max_width: int = 60) -> list[int]:
+    """
+    Largeurs calculées côté pandas (une passe str.len vectorisée par colonne)
+    au lieu de parcourir chaque Cell openpyxl — et sur toute la colonne,
+    plus besoin d'échantillonner.
+    """
+    if df.empty:
+        # feuille sans lignes : largeur des en-têtes uniquement
+        return [min(len(str(c)) + 2, max_width) for c in df.columns]
+
+    cell_lens = df.astype(str).apply(lambda s: s.str.len().max())
+    widths = []
+    for col, cell_len in zip(df.columns, cell_lens):
+        w = max(int(cell_len) if pd.notna(cell_len) else 0, len(str(col))) + 2
+        widths.append(min(w, max_width))
+    return widths
+
+
+def _autosize_columns(ws, *dfs: pd.DataFrame, max_width: int = 60) -> None:
+    widths: dict[int, int] = {}
+    for df in dfs:
+        for i, w in enumerate(_column_widths(df, max_width=max_width)):
+            widths[i] = max(widths.get(i, 0), w)
+
+    for i, w in widths.items():
+        ws.set_column(i, i, w)
 
 
 def _format_sheet_as_table(ws, df: pd.DataFrame, table_name: str, style_name: str) -> None:
@@ -37,29 +53,21 @@ def _format_sheet_as_table(ws, df: pd.DataFrame, table_name: str, style_name: st
     - Auto-width
     - Table Excel (filtre intégré)
     """
-    ws.freeze_panes = "A2"
+    ws.freeze_panes(1, 0)
 
     nrows, ncols = df.shape
     if ncols == 0:
         return
 
-    last_col = get_column_letter(ncols)
-    last_row = nrows + 1  # + header
-    table_ref = f"A1:{last_col}{last_row}"
-
-    _autosize_columns(ws)
+    _autosize_columns(ws, df)
 
     # Table Excel uniquement si au moins 1 ligne de données
     if nrows >= 1:
-        t = Table(displayName=table_name, ref=table_ref)
-        t.tableStyleInfo = TableStyleInfo(
-            name=style_name,
-            showFirstColumn=False,
-            showLastColumn=False,
-            showRowStripes=True,
-            showColumnStripes=False,
-        )
-        ws.add_table(t)
+        ws.add_table(0, 0, nrows, ncols - 1, {
+            "name": table_name,
+            "style": style_name,
+            "columns": [{"header": str(c)} for c in df.columns],
+        })
 
 
 def build_resume(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
@@ -68,59 +76,45 @@ def build_resume(df: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
     - résumé par SIREN (ou SIREN demandé si présent)
     - résumé global
     """
-    d = df.copy()
-
-    group_col = "SIREN demandé" if "SIREN demandé" in d.columns else ("SIREN" if "SIREN" in d.columns else None)
+    group_col = "SIREN demandé" if "SIREN demandé" in df.columns else ("SIREN" if "SIREN" in df.columns else None)
     if group_col is None:
         return pd.DataFrame(), pd.DataFrame()
 
+    # projection étroite : on ne copie que les colonnes réellement utilisées
+    cols_needed = [c for c in dict.fromkeys((group_col, "SIRET", "État administratif", "Siège")) if c in df.columns]
+    d = df[cols_needed].copy()
+
     # Normalisation
-    if "Siège" in d.columns:
+    if "Siège" in d.columns and d["Siège"].dtype != bool:
         d["Siège"] = d["Siège"].fillna(False).astype(bool)
 
     if "État administratif" in d.columns:
-        d["Actif?"] = d["État administratif"].astype(str).str.lower().str.contains("actif")
-    else:
-        d["Actif?"] = pd.NA
+        # égalité vectorisée (et "inactif" ne matche plus par accident)
+        d["Actif?"] = d["État administratif"].isin({"Actif", "actif", "ACTIF", "A"})
+
+    # Résumé par SIREN : toutes les métriques en un seul groupby
+    # (colonne finale toujours nommée "SIREN")
+    agg_spec = {
+        "Nb SIRET": (("SIRET", "nunique") if "SIRET" in d.columns else (group_col, "size")),
+    }
+    if "Actif?" in d.columns:
+        agg_spec["Nb actifs"] = ("Actif?", "sum")
+    if "Siège" in d.columns:
+        agg_spec["Nb sièges"] = ("Siège", "sum")
 
-    # Résumé par SIREN (colonne finale toujours nommée "SIREN")
     res = (
-        d.groupby(group_col)
-        .agg(**{
-            "Nb SIRET": (("SIRET" if "SIRET" in d.columns else group_col),
-                        "nunique" if "SIRET" in d.columns else "size"),
-        })
+        # sort=False : inutile de trier les clés, le résultat est re-trié par "Nb SIRET"
+        d.groupby(group_col, sort=False)
+        .agg(**agg_spec)
         .reset_index()
         .rename(columns={group_col: "SIREN"})
     )
 
-    # Merge helper (évite de supprimer SIREN quand group_col == "SIREN")
-    def merge_metric(res_df: pd.DataFrame, metric_df: pd.DataFrame, metric_col_original: str) -> pd.DataFrame:
-        # metric_df contient la clé `group_col` + la métrique renommée
-        merged = res_df.merge(metric_df, left_on="SIREN", right_on=group_col, how="left")
-        if group_col != "SIREN":
-            merged = merged.drop(columns=[group_col])
-        return merged
-
-    if "Actif?" in d.columns:
-        actifs = (
-            d.groupby(group_col)["Actif?"]
-            .sum(min_count=1)
-            .reset_index()
-            .rename(columns={"Actif?": "Nb actifs"})
-        )
-        res = merge_metric(res, actifs, "Actif?")
+    if "Nb actifs" in res.columns:
         res["Nb actifs"] = res["Nb actifs"].fillna(0).astype(int)
         res["Nb fermés"] = (res["Nb SIRET"] - res["Nb actifs"]).clip(lower=0)
 
-    if "Siège" in d.columns:
-        sieges = (
-            d.groupby(group_col)["Siège"]
-            .sum(min_count=1)
-            .reset_index()
-            .rename(columns={"Siège": "Nb sièges"})
-        )
-        res = merge_metric(res, sieges, "Siège")
+    if "Nb sièges" in res.columns:
         res["Nb sièges"] = res["Nb sièges"].fillna(0).astype(int)
 
     # Résumé global
@@ -154,17 +148,18 @@ def export_sirets_xlsx(df: pd.DataFrame) -> bytes:
     - Onglet SIRET : Table Excel filtrable
     - Onglet Résumé : global + par SIREN
     """
-    d = df.copy()
-    d.columns = _make_unique_columns(d.columns)
+    # nouveau jeu d'étiquettes sans dupliquer les données
+    d = df.set_axis(_make_unique_columns(df.columns), axis=1)
 
     resume_par_siren, resume_global = build_resume(d)
 
     output = BytesIO()
-    with pd.ExcelWriter(output, engine="openpyxl") as writer:
+    # xlsxwriter écrit les lignes en flux (pas d'objets Cell en mémoire)
+    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
         # Onglet SIRET
         d.to_excel(writer, index=False, sheet_name="SIRET")
-        ws_s = writer.book["SIRET"]
-        _format_sheet_as_table(ws_s, d, table_name="T_SIRET", style_name="TableStyleMedium9")
+        ws_s = writer.sheets["SIRET"]
+        _format_sheet_as_table(ws_s, d, table_name="T_SIRET", style_name="Table Style Medium 9")
 
         # Onglet Résumé
         start_row = 0
@@ -175,27 +170,18 @@ def export_sirets_xlsx(df: pd.DataFrame) -> bytes:
         if not resume_par_siren.empty:
             resume_par_siren.to_excel(writer, index=False, sheet_name="Résumé", startrow=start_row)
 
-        ws_r = writer.book["Résumé"]
-        ws_r.freeze_panes = "A2"
-        _autosize_columns(ws_r)
+        ws_r = writer.sheets["Résumé"]
+        ws_r.freeze_panes(1, 0)
+        _autosize_columns(ws_r, *(b for b in (resume_global, resume_par_siren) if not b.empty))
 
         # Table Excel sur le bloc "par SIREN" si présent
         if not resume_par_siren.empty:
             nrows, ncols = resume_par_siren.shape
-            last_col = get_column_letter(ncols)
-            table_top = start_row + 1  # startrow est 0-index côté pandas, Excel est 1-index
-            table_bottom = start_row + 1 + nrows  # + header
-            table_ref = f"A{table_top}:{last_col}{table_bottom}"
-
-            t = Table(displayName="T_RESUME", ref=table_ref)
-            t.tableStyleInfo = TableStyleInfo(
-                name="TableStyleLight9",
-                showFirstColumn=False,
-                showLastColumn=False,
-                showRowStripes=True,
-                showColumnStripes=False,
-            )
-            ws_r.add_table(t)
+            ws_r.add_table(start_row, 0, start_row + nrows, ncols - 1, {
+                "name": "T_RESUME",
+                "style": "Table Style Light 9",
+                "columns": [{"header": str(c)} for c in resume_par_siren.columns],
+            })
 
     output.seek(0)
     return output.getvalue()
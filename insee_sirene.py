@@ -1,276 +1,501 @@
-import time
-from typing import Dict, List, Tuple, Optional, Callable
-
-import requests
-from datetime import date
-
-
-BASE_URL = "https://api.insee.fr/api-sirene/3.11"
-
-# Champs "aplatis" attendus par le paramètre `champs`
-CHAMPS_ETAB = ",".join([
-    # Identifiants
-    "siret", "siren", "etablissementSiege",
-
-    # Unité légale (nom)
-    "denominationUniteLegale", "nomUniteLegale", "prenom1UniteLegale",
-
-    # Établissement (enseigne / dénomination usuelle / état admin)
-    "enseigne1Etablissement", "enseigne2Etablissement", "enseigne3Etablissement",
-    "denominationUsuelleEtablissement",
-    "etatAdministratifEtablissement",
-
-    # Adresse établissement
-    "complementAdresseEtablissement",
-    "numeroVoieEtablissement", "indiceRepetitionEtablissement",
-    "typeVoieEtablissement", "libelleVoieEtablissement",
-    "distributionSpecialeEtablissement",
-    "codePostalEtablissement",
-    "libelleCommuneEtablissement",
-    "libelleCedexEtablissement",
-])
-
-
-def _headers(api_key: str) -> Dict[str, str]:
-    return {
-        "Accept": "application/json",
-        "X-INSEE-Api-Key-Integration": api_key,
-        "User-Agent": "streamlit-siren-to-siret/1.0",
-    }
-
-
-def _normalize_siren(raw: str) -> str:
-    siren = "".join(ch for ch in (raw or "") if ch.isdigit())
-    if len(siren) != 9:
-        raise ValueError("Le SIREN doit contenir exactement 9 chiffres.")
-    return siren
-
-
-def _latest_period(periodes: list) -> dict:
-    """Prend la période la plus pertinente : dateFin vide (courante) sinon dateDebut max."""
-    if not periodes:
-        return {}
-    current = [p for p in periodes if not p.get("dateFin")]
-    if current:
-        return current[0]
-    return max(periodes, key=lambda p: p.get("dateDebut", "0000-00-00"))
-
-
-def _get_unite_legale_name(etab: dict) -> str:
-    ul = (etab or {}).get("uniteLegale") or {}
-
-    # 1) format "nested"
-    denom = (ul.get("denominationUniteLegale") or "").strip()
-    if denom:
-        return denom
-    nom = (ul.get("nomUniteLegale") or "").strip()
-    prenom = (ul.get("prenom1UniteLegale") or "").strip()
-    full = " ".join([prenom, nom]).strip()
-    if full:
-        return full
-
-    # 2) format "aplati"
-    denom = (etab.get("denominationUniteLegale") or "").strip()
-    if denom:
-        return denom
-    nom = (etab.get("nomUniteLegale") or "").strip()
-    prenom = (etab.get("prenom1UniteLegale") or "").strip()
-    return " ".join([prenom, nom]).strip()
-
-
-def _get_etablissement_label(etab: dict) -> str:
-    # 1) nested (périodes)
-    periodes = (etab or {}).get("periodesEtablissement") or []
-    p0 = _latest_period(periodes) if periodes else {}
-
-    enseignes = [
-        (p0.get("enseigne1Etablissement") or "").strip(),
-        (p0.get("enseigne2Etablissement") or "").strip(),
-        (p0.get("enseigne3Etablissement") or "").strip(),
-    ]
-    enseignes = [e for e in enseignes if e]
-    if enseignes:
-        return " / ".join(enseignes)
-
-    denom_usuelle = (p0.get("denominationUsuelleEtablissement") or "").strip()
-    if denom_usuelle:
-        return denom_usuelle
-
-    # 2) aplati
-    enseignes = [
-        (etab.get("enseigne1Etablissement") or "").strip(),
-        (etab.get("enseigne2Etablissement") or "").strip(),
-        (etab.get("enseigne3Etablissement") or "").strip(),
-    ]
-    enseignes = [e for e in enseignes if e]
-    if enseignes:
-        return " / ".join(enseignes)
-
-    denom_usuelle = (etab.get("denominationUsuelleEtablissement") or "").strip()
-    return denom_usuelle or ""
-
-
-def _get_etat_admin(etab: dict) -> str:
-    # 1) nested (périodes)
-    periodes = (etab or {}).get("periodesEtablissement") or []
-    if periodes:
-        p0 = _latest_period(periodes)
-        v = (p0.get("etatAdministratifEtablissement") or "").strip()
-        if v:
-            return v
-
-    # 2) aplati
-    return (etab.get("etatAdministratifEtablissement") or "").strip()
-
-
-def _format_adresse(etab: dict) -> Dict[str, str]:
-    adr = (etab or {}).get("adresseEtablissement") or {}
-
-    def pick(k: str) -> str:
-        return (adr.get(k) or etab.get(k) or "").strip()
-
-    voie = " ".join(filter(None, [
-        pick("numeroVoieEtablissement"),
-        pick("indiceRepetitionEtablissement"),
-        pick("typeVoieEtablissement"),
-        pick("libelleVoieEtablissement"),
-    ])).strip()
-
-    complement = pick("complementAdresseEtablissement")
-    dist = pick("distributionSpecialeEtablissement")
-    cp = pick("codePostalEtablissement")
-    commune = pick("libelleCommuneEtablissement")
-    cedex = pick("libelleCedexEtablissement")
-
-    parts = [p for p in [complement, voie, dist] if p]
-    adresse = ", ".join(parts)
-    ville = cedex or commune
-
-    return {"Adresse": adresse, "Code postal": cp, "Ville": ville}
-
-
-def get_sirets_from_siren(
-    siren: str,
-    api_key: str,
-    only_active: bool = True,
-    as_of_date: str | None = None,
-    page_size: int = 500,
-    max_pages: int = 500,
-    max_429_retries: int = 15,
-    base_sleep_s: float = 0.2,
-    timeout_s: int = 30,
-    should_stop: Optional[Callable[[], bool]] = None,
-    on_page: Optional[Callable[[int, int], None]] = None,
-) -> Tuple[List[dict], List[dict]]:
-    
-    siren = _normalize_siren(siren)
-
-    if as_of_date is None:
-        as_of_date = date.today().isoformat()  # "YYYY-MM-DD"
-
-
-    q = f'siren:"{siren}"'
-    if only_active:
-        q += " AND periode(etatAdministratifEtablissement:A)"
-
-    url = f"{BASE_URL}/siret"
-    curseur = "*"
-
-    all_etabs: List[dict] = []
-    rows: List[dict] = []
-
-    retry_429 = 0
-    status_map = {"A": "Actif", "F": "Fermé"}
-
-    # Optionnel mais utile : réutilise la connexion TCP
-    session = requests.Session()
-
-    for page in range(max_pages):
-        if should_stop and should_stop():
-            raise RuntimeError("STOP_REQUESTED")
-
-        time.sleep(base_sleep_s)
-
-        params = {
-            "q": q,
-            "date": as_of_date,
-            "nombre": page_size,
-            "curseur": curseur,
-            "champs": CHAMPS_ETAB,
-        }
-
-        try:
-            r = session.get(url, headers=_headers(api_key), params=params, timeout=timeout_s)
-        except requests.RequestException as e:
-            raise RuntimeError(f"Erreur réseau INSEE: {e}") from e
-
-        if r.status_code == 429:
-            retry_429 += 1
-            if retry_429 > max_429_retries:
-                raise RuntimeError("Trop de 429 (rate limit). Réessaie plus tard ou ralentis les appels.")
-            time.sleep(1.0 * retry_429)
-            continue
-
-        retry_429 = 0
-
-        if r.status_code == 401:
-            raise RuntimeError(
-                "401 Unauthorized : clé INSEE invalide/non autorisée. "
-                "Vérifie la souscription à l'API Sirene (plan Public) et le header X-INSEE-Api-Key-Integration."
-            )
-
-        if r.status_code == 400:
-            raise RuntimeError(f"400. URL={r.url}\nRéponse={r.text[:400]}")
-
-        r.raise_for_status()
-        data = r.json()
-
-        etabs = data.get("etablissements", []) or []
-        header = data.get("header", {}) or {}
-
-        all_etabs.extend(etabs)
-
-        for e in etabs:
-            siret_val = e.get("siret", "")
-            if not siret_val:
-                continue
-
-            etat_code = _get_etat_admin(e)
-            if only_active and etat_code and etat_code != "A":
-                continue
-            adr = _format_adresse(e)
-
-            nom_ul = _get_unite_legale_name(e)
-            nom_etab = _get_etablissement_label(e) or ""
-
-            rows.append({
-                "SIRET": siret_val,
-                "SIREN": e.get("siren", ""),
-                "Nom unité légale": nom_ul,
-                "Nom établissement": nom_etab,
-                "Siège": bool(e.get("etablissementSiege")),
-                "État administratif": status_map.get(etat_code, etat_code),
-                **adr,
-            })
-
-        if on_page:
-            on_page(page + 1, len(rows))
-
-        next_cursor = header.get("curseurSuivant")
-
-        if not next_cursor:
-            break
-        if next_cursor == curseur:
-            break
-
-        curseur = next_cursor
-
-    else:
-        raise RuntimeError(f"Arrêt sécurité : max_pages={max_pages} atteint (SIREN très volumineux ?).")
-
-    # Dédoublonnage par SIRET
-    dedup = {row["SIRET"]: row for row in rows}
-    rows = list(dedup.values())
-    rows.sort(key=lambda x: x.get("SIRET", ""))
-
-    return rows, all_etabs
+import random
+import string
+import time
+from collections import ChainMap
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from io import BytesIO
+from operator import itemgetter
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, Tuple, Optional, Callable
+
+import requests
+from requests.adapters import HTTPAdapter
+from datetime import date
+
+try:
+    # parseur Rust ~3-5x plus rapide que le json stdlib, et qui décode
+    # l'UTF-8 directement depuis les octets (une copie de moins)
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+try:
+    # parse incrémental : pic mémoire ~constant au lieu de tout le forêt de
+    # dicts d'une page de 500 établissements
+    import ijson
+except ImportError:
+    ijson = None
+
+
+BASE_URL = "https://api.insee.fr/api-sirene/3.11"
+
+# Session partagée : le handshake TCP+TLS vers api.insee.fr est payé une fois
+# pour tout le process, quel que soit le nombre de SIREN interrogés
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
+# bornes du backoff / pacing adaptatif
+_BACKOFF_CAP_S = 30.0
+_SLEEP_FLOOR_S = 0.05
+_SLEEP_CEIL_S = 2.0
+
+# Listing minimal : pagination bon marché quand le détail n'est pas affiché
+# (réponses ~4x plus légères => moins d'octets transférés et à parser)
+CHAMPS_MIN = ",".join([
+    "siret", "siren", "etablissementSiege",
+    "etatAdministratifEtablissement",
+])
+
+# Champs "aplatis" attendus par le paramètre `champs`
+CHAMPS_FULL = ",".join([
+    # Identifiants
+    "siret", "siren", "etablissementSiege",
+
+    # Unité légale (nom)
+    "denominationUniteLegale", "nomUniteLegale", "prenom1UniteLegale",
+
+    # Établissement (enseigne / dénomination usuelle / état admin)
+    "enseigne1Etablissement", "enseigne2Etablissement", "enseigne3Etablissement",
+    "denominationUsuelleEtablissement",
+    "etatAdministratifEtablissement",
+
+    # Adresse établissement
+    "complementAdresseEtablissement",
+    "numeroVoieEtablissement", "indiceRepetitionEtablissement",
+    "typeVoieEtablissement", "libelleVoieEtablissement",
+    "distributionSpecialeEtablissement",
+    "codePostalEtablissement",
+    "libelleCommuneEtablissement",
+    "libelleCedexEtablissement",
+])
+
+
+def _parse_page(body: bytes) -> Tuple[dict, Iterable[dict]]:
+    """
+    (header, établissements) d'une page. Avec ijson, les établissements sont
+    produits un par un et libérables sitôt consommés ; sans, fallback sur le
+    parse complet.
+    """
+    if ijson is None:
+        data = _json_loads(body)
+        return data.get("header", {}) or {}, data.get("etablissements", []) or []
+
+    header = next(ijson.items(BytesIO(body), "header"), None) or {}
+    return header, ijson.items(BytesIO(body), "etablissements.item")
+
+
+@lru_cache(maxsize=4)
+def _headers(api_key: str) -> Mapping[str, str]:
+    return MappingProxyType({
+        "Accept": "application/json",
+        "X-INSEE-Api-Key-Integration": api_key,
+        "User-Agent": "streamlit-siren-to-siret/1.0",
+    })
+
+
+# table pour str.translate : supprime tout caractère imprimable non-chiffre
+_NONDIGIT_TRANS = {c: None for c in map(ord, string.printable) if not chr(c).isdigit()}
+
+
+def _normalize_siren(raw: str) -> str:
+    # cas courant (déjà propre) : aucune allocation
+    if raw and len(raw) == 9 and raw.isdigit():
+        return raw
+
+    siren = (raw or "").translate(_NONDIGIT_TRANS)
+    if len(siren) != 9:
+        # séparateurs hors ASCII (NBSP des copier-coller FR, etc.) :
+        # retombe sur le filtre caractère par caractère
+        siren = "".join(ch for ch in (raw or "") if ch.isdigit())
+    if len(siren) != 9:
+        raise ValueError("Le SIREN doit contenir exactement 9 chiffres.")
+    return siren
+
+
+def _s(v: Optional[str]) -> str:
+    """(v or "").strip() avec sortie immédiate quand le champ est vide/absent."""
+    return v.strip() if v else ""
+
+
+def _latest_period(periodes: list) -> dict:
+    """Prend la période la plus pertinente : dateFin vide (courante) sinon dateDebut max."""
+    if not periodes:
+        return {}
+    try:
+        # next() court-circuite à la première période courante, sans liste intermédiaire
+        return next(p for p in periodes if not p.get("dateFin"))
+    except StopIteration:
+        return max(periodes, key=lambda p: p.get("dateDebut", "0000-00-00"))
+
+
+def _get_unite_legale_name(etab: dict) -> str:
+    ul = (etab or {}).get("uniteLegale") or {}
+
+    # 1) format "nested"
+    denom = _s(ul.get("denominationUniteLegale"))
+    if denom:
+        return denom
+    nom = _s(ul.get("nomUniteLegale"))
+    prenom = _s(ul.get("prenom1UniteLegale"))
+    full = " ".join([prenom, nom]).strip()
+    if full:
+        return full
+
+    # 2) format "aplati"
+    denom = _s(etab.get("denominationUniteLegale"))
+    if denom:
+        return denom
+    nom = _s(etab.get("nomUniteLegale"))
+    prenom = _s(etab.get("prenom1UniteLegale"))
+    return " ".join([prenom, nom]).strip()
+
+
+def _get_etablissement_label(etab: dict, p0: Optional[dict] = None) -> str:
+    # `p0` peut être fourni par l'appelant pour éviter de recalculer
+    # _latest_period sur la même liste dans chaque helper
+    if p0 is None:
+        periodes = (etab or {}).get("periodesEtablissement") or []
+        p0 = _latest_period(periodes) if periodes else {}
+
+    # nested (période courante) puis aplati, en court-circuitant dès qu'une
+    # source répond — la forme nested gagnante ne paie plus le bloc aplati
+    for src in (p0, etab):
+        e1 = _s(src.get("enseigne1Etablissement"))
+        e2 = _s(src.get("enseigne2Etablissement"))
+        e3 = _s(src.get("enseigne3Etablissement"))
+        if e1 or e2 or e3:
+            return " / ".join(e for e in (e1, e2, e3) if e)
+
+        denom_usuelle = _s(src.get("denominationUsuelleEtablissement"))
+        if denom_usuelle:
+            return denom_usuelle
+
+    return ""
+
+
+def _get_etat_admin(etab: dict, p0: Optional[dict] = None) -> str:
+    # 1) nested (périodes)
+    if p0 is None:
+        periodes = (etab or {}).get("periodesEtablissement") or []
+        p0 = _latest_period(periodes) if periodes else {}
+    if v := _s(p0.get("etatAdministratifEtablissement")):
+        return v
+
+    # 2) aplati
+    return _s(etab.get("etatAdministratifEtablissement"))
+
+
+_VOIE_KEYS = (
+    "numeroVoieEtablissement",
+    "indiceRepetitionEtablissement",
+    "typeVoieEtablissement",
+    "libelleVoieEtablissement",
+)
+
+
+def _format_adresse(etab: dict) -> Tuple[str, str, str]:
+    """Retourne (adresse, code postal, ville) — tuple, pas de dict par ligne."""
+    adr = (etab or {}).get("adresseEtablissement") or {}
+
+    # fallback nested -> aplati en une seule vue, au lieu de 2 .get par champ
+    src = ChainMap(adr, etab)
+
+    voie = " ".join(s for k in _VOIE_KEYS if (s := _s(src.get(k))))
+
+    complement = _s(src.get("complementAdresseEtablissement"))
+    dist = _s(src.get("distributionSpecialeEtablissement"))
+    cp = _s(src.get("codePostalEtablissement"))
+    commune = _s(src.get("libelleCommuneEtablissement"))
+    cedex = _s(src.get("libelleCedexEtablissement"))
+
+    adresse = ", ".join(p for p in (complement, voie, dist) if p)
+    ville = cedex or commune
+
+    return adresse, cp, ville
+
+
+def _build_query(sirens: List[str], only_active: bool) -> str:
+    if len(sirens) == 1:
+        q = f'siren:"{sirens[0]}"'
+    else:
+        q = "siren:(" + " OR ".join(f'"{s}"' for s in sirens) + ")"
+    if only_active:
+        q += " AND periode(etatAdministratifEtablissement:A)"
+    return q
+
+
+def get_sirets_from_siren(
+    siren: str,
+    api_key: str,
+    only_active: bool = True,
+    as_of_date: str | None = None,
+    page_size: int = 500,
+    max_pages: int = 500,
+    max_429_retries: int = 15,
+    max_5xx_retries: int = 5,
+    base_sleep_s: float = 0.2,
+    timeout_s: int = 30,
+    should_stop: Optional[Callable[[], bool]] = None,
+    on_page: Optional[Callable[[int, int], None]] = None,
+    detail: bool = True,
+    return_raw: bool = False,
+) -> Tuple[List[dict], List[dict]]:
+
+    siren = _normalize_siren(siren)
+
+    if as_of_date is None:
+        as_of_date = date.today().isoformat()  # "YYYY-MM-DD"
+
+    return _crawl_sirets(
+        q=_build_query([siren], only_active),
+        api_key=api_key,
+        only_active=only_active,
+        as_of_date=as_of_date,
+        page_size=page_size,
+        max_pages=max_pages,
+        max_429_retries=max_429_retries,
+        max_5xx_retries=max_5xx_retries,
+        base_sleep_s=base_sleep_s,
+        timeout_s=timeout_s,
+        should_stop=should_stop,
+        on_page=on_page,
+        detail=detail,
+        return_raw=return_raw,
+    )
+
+
+def get_sirets_from_sirens(
+    sirens: List[str],
+    api_key: str,
+    only_active: bool = True,
+    as_of_date: str | None = None,
+    page_size: int = 500,
+    chunk_size: int = 20,
+    max_pages: int = 500,
+    max_429_retries: int = 15,
+    max_5xx_retries: int = 5,
+    base_sleep_s: float = 0.2,
+    timeout_s: int = 30,
+    should_stop: Optional[Callable[[], bool]] = None,
+    detail: bool = True,
+) -> Dict[str, List[dict]]:
+    """
+    Variante batch : regroupe les SIREN par paquets de `chunk_size` dans une
+    seule requête `siren:(A OR B OR ...)` puis démultiplexe les lignes par
+    SIREN — ~chunk_size fois moins de requêtes (et d'amorçages de pagination)
+    que des appels unitaires en boucle.
+    """
+    sirens_norm = list(dict.fromkeys(_normalize_siren(s) for s in sirens))
+
+    if as_of_date is None:
+        as_of_date = date.today().isoformat()  # "YYYY-MM-DD"
+
+    out: Dict[str, List[dict]] = {s: [] for s in sirens_norm}
+
+    for i in range(0, len(sirens_norm), chunk_size):
+        chunk = sirens_norm[i:i + chunk_size]
+        rows, _ = _crawl_sirets(
+            q=_build_query(chunk, only_active),
+            api_key=api_key,
+            only_active=only_active,
+            as_of_date=as_of_date,
+            page_size=page_size,
+            max_pages=max_pages,
+            max_429_retries=max_429_retries,
+            max_5xx_retries=max_5xx_retries,
+            base_sleep_s=base_sleep_s,
+            timeout_s=timeout_s,
+            should_stop=should_stop,
+            on_page=None,
+            detail=detail,
+        )
+        for row in rows:
+            out.setdefault(row.get("SIREN", ""), []).append(row)
+
+    return out
+
+
+def _crawl_sirets(
+    q: str,
+    api_key: str,
+    only_active: bool,
+    as_of_date: str,
+    page_size: int,
+    max_pages: int,
+    max_429_retries: int,
+    max_5xx_retries: int,
+    base_sleep_s: float,
+    timeout_s: int,
+    should_stop: Optional[Callable[[], bool]],
+    on_page: Optional[Callable[[int, int], None]],
+    detail: bool,
+    return_raw: bool = False,
+) -> Tuple[List[dict], List[dict]]:
+
+    url = f"{BASE_URL}/siret"
+    curseur = "*"
+
+    all_etabs: List[dict] = []
+    # dict clé=SIRET : dédoublonnage au fil de l'eau, pas de passe finale
+    rows: Dict[str, dict] = {}
+
+    retry_429 = 0
+    retry_5xx = 0
+    status_map = {"A": "Actif", "F": "Fermé"}
+
+    session = _SESSION
+    # headers posés une fois sur la Session plutôt que re-fusionnés à chaque .get
+    session.headers.update(_headers(api_key))
+
+    params = {
+        "q": q,
+        "date": as_of_date,
+        "nombre": page_size,
+        "champs": CHAMPS_FULL if detail else CHAMPS_MIN,
+    }
+
+    def _fetch(cursor: str) -> requests.Response:
+        time.sleep(base_sleep_s)
+        # un seul GET en vol à la fois : on peut muter `params` en place
+        params["curseur"] = cursor
+        return session.get(url, params=params, timeout=timeout_s)
+
+    # look-ahead d'une page : le GET de la page N+1 part pendant qu'on
+    # construit les lignes de la page N (le curseur impose ce plafond)
+    next_fut = None
+
+    with ThreadPoolExecutor(max_workers=1) as prefetch:
+        for page in range(max_pages):
+            if should_stop and should_stop():
+                if next_fut is not None:
+                    next_fut.cancel()
+                raise RuntimeError("STOP_REQUESTED")
+
+            try:
+                if next_fut is not None:
+                    r = next_fut.result()
+                    next_fut = None
+                else:
+                    r = _fetch(curseur)
+            except requests.RequestException as e:
+                raise RuntimeError(f"Erreur réseau INSEE: {e}") from e
+
+            if r.status_code == 429:
+                retry_429 += 1
+                if retry_429 > max_429_retries:
+                    raise RuntimeError("Trop de 429 (rate limit). Réessaie plus tard ou ralentis les appels.")
+                # honore Retry-After si présent, sinon backoff exponentiel + jitter
+                retry_after = r.headers.get("Retry-After")
+                try:
+                    sleep_s = float(retry_after)
+                except (TypeError, ValueError):
+                    sleep_s = min(_BACKOFF_CAP_S, base_sleep_s * 2 ** retry_429) + random.uniform(0, base_sleep_s)
+                time.sleep(sleep_s)
+                continue
+
+            retry_429 = 0
+
+            # 5xx transitoires (l'endpoint Sirene rend périodiquement des 502) :
+            # on rejoue la même page (curseur inchangé) avec le même backoff,
+            # au lieu de jeter toute la progression du crawl
+            if r.status_code in (500, 502, 503, 504):
+                retry_5xx += 1
+                if retry_5xx > max_5xx_retries:
+                    raise RuntimeError(f"Erreur {r.status_code} INSEE persistante après {max_5xx_retries} tentatives.")
+                # disjoncteur : des 5xx consécutifs => on réduit la charge serveur
+                if retry_5xx >= 2 and page_size > 20:
+                    page_size = max(20, page_size // 2)
+                    params["nombre"] = page_size
+                time.sleep(min(_BACKOFF_CAP_S, base_sleep_s * 2 ** retry_5xx) + random.uniform(0, base_sleep_s))
+                continue
+
+            retry_5xx = 0
+
+            # pacing AIMD sur le quota annoncé : on ralentit fort quand le quota
+            # s'épuise, on ré-accélère doucement quand il est confortable
+            remaining = r.headers.get("X-RateLimit-Remaining", "")
+            if remaining.isdigit():
+                if int(remaining) < 5:
+                    base_sleep_s = min(_SLEEP_CEIL_S, base_sleep_s * 1.5)
+                else:
+                    base_sleep_s = max(_SLEEP_FLOOR_S, base_sleep_s * 0.9)
+
+            if r.status_code == 401:
+                raise RuntimeError(
+                    "401 Unauthorized : clé INSEE invalide/non autorisée. "
+                    "Vérifie la souscription à l'API Sirene (plan Public) et le header X-INSEE-Api-Key-Integration."
+                )
+
+            if r.status_code == 400:
+                raise RuntimeError(f"400. URL={r.url}\nRéponse={r.text[:400]}")
+
+            r.raise_for_status()
+            header, etabs = _parse_page(r.content)
+
+            # le GET de la page suivante part maintenant, pendant qu'on
+            # construit les lignes de celle-ci
+            next_cursor = header.get("curseurSuivant")
+            if next_cursor and next_cursor != curseur:
+                next_fut = prefetch.submit(_fetch, next_cursor)
+
+            for e in etabs:
+                # opt-in : garder tout le JSON brut vivant coûte des dizaines
+                # de Mo sur un gros SIREN alors que la plupart des appelants
+                # n'utilisent que `rows`
+                if return_raw:
+                    all_etabs.append(e)
+
+                siret_val = e.get("siret", "")
+                if not siret_val or siret_val in rows:
+                    # doublon inter-pages (bord de curseur) : rejeté avant de
+                    # payer le formatage nom/adresse
+                    continue
+
+                # période courante calculée une seule fois pour tous les helpers
+                # (inutile en mode minimal filtré serveur : personne ne la lit)
+                p0: dict = {}
+                if detail or not only_active:
+                    periodes = e.get("periodesEtablissement") or []
+                    p0 = _latest_period(periodes) if periodes else {}
+
+                # only_active : le serveur filtre déjà (clause periode(...:A)),
+                # inutile de re-dériver l'état depuis les périodes par ligne
+                etat_code = "A" if only_active else _get_etat_admin(e, p0)
+
+                if detail:
+                    adresse, cp, ville = _format_adresse(e)
+                    rows[siret_val] = {
+                        "SIRET": siret_val,
+                        "SIREN": e.get("siren", ""),
+                        "Nom unité légale": _get_unite_legale_name(e),
+                        "Nom établissement": _get_etablissement_label(e, p0) or "",
+                        "Siège": bool(e.get("etablissementSiege")),
+                        "État administratif": status_map.get(etat_code, etat_code),
+                        "Adresse": adresse,
+                        "Code postal": cp,
+                        "Ville": ville,
+                    }
+                else:
+                    rows[siret_val] = {
+                        "SIRET": siret_val,
+                        "SIREN": e.get("siren", ""),
+                        "Siège": bool(e.get("etablissementSiege")),
+                        "État administratif": status_map.get(etat_code, etat_code),
+                    }
+
+            if on_page:
+                on_page(page + 1, len(rows))
+
+            if not next_cursor:
+                break
+            if next_cursor == curseur:
+                break
+
+            curseur = next_cursor
+
+        else:
+            raise RuntimeError(f"Arrêt sécurité : max_pages={max_pages} atteint (SIREN très volumineux ?).")
+
+    # itemgetter : callback de tri en C (la clé "SIRET" est toujours présente)
+    return sorted(rows.values(), key=itemgetter("SIRET")), all_etabs